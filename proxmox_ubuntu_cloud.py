@@ -1,24 +1,58 @@
 """Ubuntu Cloud on Proxmox virtual machine builder library."""
 
-# pylint: disable=logging-fstring-interpolation
-
-import ipaddress
+import concurrent.futures
+import functools
+import json
 import logging
+import os
 import time
 import configparser
 import sys
+import threading
 import urllib.parse
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 from proxmoxer import ProxmoxAPI
 import vmtypes
 
+VMINFO_CACHE_DIR = os.path.expanduser("~/.cache/virthelper")
+VMINFO_CACHE_TTL_SECS = 15
+# Upper bound on concurrent Proxmox API requests, and the size of the
+# keep-alive connection pool that serves them.
+PROXMOX_API_CONCURRENCY = 16
+# cloud-init ipconfig address and gateway keys, by IP version.
+IP_FAMILY_CONFIG = {
+    4: ('ip', 'gw'),
+    6: ('ip6', 'gw6'),
+}
+
+@functools.lru_cache(maxsize=8)
+def loadAuthParams(cf, cf_mtime, cluster):
+    """read and cache API auth parameters for cluster from config file.
+
+    cf_mtime is only used as part of the cache key, so that edits to
+    the config file are picked up.
+    """
+    cfg = configparser.ConfigParser()
+    cfg.read(cf)
+    if not cfg.has_section(cluster):
+        logging.error("Did not find cluster %s in authentication config.", cluster)
+        sys.exit(1)
+    params = cfg.items(cluster)
+    pd = dict(params)
+    logging.info("Using authentication params: User: %s; Token: %s.", pd['user'], pd['token'])
+    return pd
+
 class ProxmoxUbuntuCloud(vmtypes.BaseVM):
     """Ubuntu-Cloud Proxmox configuration."""
 
     name = "ProxmoxUbuntuCloud"
+    # Serialises VM ID allocation with clone submission.
+    clone_lock = threading.Lock()
 
     def __init__(self):
-        super(ProxmoxUbuntuCloud, self).__init__()
+        super().__init__()
         auth_params = self.getAuthParams(
             self.args.config,
             self.args.cluster)
@@ -27,84 +61,184 @@ class ProxmoxUbuntuCloud(vmtypes.BaseVM):
             user=auth_params['user'],
             token_name=auth_params['token'],
             token_value=auth_params['secret'],
-            verify_ssl=self.args.noverify_ssl)
-        self.allvminfo = {}
-        self.getAllVMInfo()
+            verify_ssl=self.args.verify_ssl)
+        if not self.args.verify_ssl:
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        # proxmoxer keeps a single requests.Session for every call. Widen
+        # its pool so concurrent requests keep their keep-alive connections
+        # rather than discarding them when the pool is full.
+        session = self.proxmox._store['session']
+        session.mount(
+            "https://", HTTPAdapter(pool_connections=PROXMOX_API_CONCURRENCY,
+                                    pool_maxsize=PROXMOX_API_CONCURRENCY))
+        # Populated on first use by getAllVMInfo.
+        self.allvminfo = None
+        self.vmsbyname = {}
+        self.sshkeys = None
 
     def getAuthParams(self, cf, cluster):
         """read API auth parameters from config file."""
-        cfg = configparser.ConfigParser()
-        cfg.read(cf)
-        if not cfg.has_section(cluster):
-            logging.error(f"Did not find cluster {cluster} in authentication config.")
-            sys.exit(1)
-        params = cfg.items(cluster)
-        pd = dict(params)
-        logging.info(f"Using authentication params: User: {pd['user']}; Token: {pd['token']}.")
-        return pd
+        return dict(loadAuthParams(cf, os.stat(cf).st_mtime, cluster))
 
     def getGateway(self):
         """Depending on IP address and gateway args, return a gateway argument for cloud config."""
 
         if self.args.gateway:
-            return super(ProxmoxUbuntuCloud, self).getGateway()
+            return super().getGateway()
 
-        family = self.getIPAddressFamily(self.getIPAddress)
+        family = self.getIPAddressFamily(self.getIPAddress())
         if family == "ipv4":
             return "dhcp"
         if family == "ipv6":
             return "auto"
 
         logging.fatal("Unable to determine IP gateway.")
-        raise
+        raise vmtypes.HandledException("Unable to determine IP gateway.")
 
     def getNodeName(self):
         """return node name from vm_host."""
-        node_name = self.args.vm_host.split(".")[0]
-        logging.debug(f"Returning node name {node_name} from vm host {self.args.vm_host}.")
+        node_name = self.args.vm_host.partition(".")[0]
+        logging.debug("Returning node name %s from vm host %s.", node_name, self.args.vm_host)
         return node_name
 
+    def getVMInfoCachePath(self):
+        """return on-disk path of the cached VM info for this cluster."""
+        return os.path.join(VMINFO_CACHE_DIR, f"{self.args.cluster}.json")
+
+    def loadVMInfoCache(self, max_age_secs=None):
+        """return cached VM info, or None if missing or older than max_age_secs."""
+        cache_path = self.getVMInfoCachePath()
+        try:
+            if (max_age_secs is not None and
+                    time.time() - os.stat(cache_path).st_mtime > max_age_secs):
+                return None
+            with open(cache_path, 'r') as f:
+                # JSON object keys are strings; vmids are integers.
+                return {int(vmid): vm for vmid, vm in json.load(f).items()}
+        except (OSError, ValueError):
+            return None
+
+    def saveVMInfoCache(self, allvminfo):
+        """write VM info to the on-disk cache."""
+        cache_path = self.getVMInfoCachePath()
+        os.makedirs(VMINFO_CACHE_DIR, exist_ok=True)
+        with open(f"{cache_path}.tmp", 'w') as f:
+            json.dump(allvminfo, f)
+        os.replace(f"{cache_path}.tmp", cache_path)
+
+    def invalidateVMInfoCache(self):
+        """drop on-disk VM info after VMs are created or deleted."""
+        try:
+            os.remove(self.getVMInfoCachePath())
+        except FileNotFoundError:
+            pass
+
     def getAllVMInfo(self):
         """Make a dict containing information on all VMs."""
-        if not self.allvminfo:
-            logging.info("Creating dict of all VM info.")
-            for node in self.proxmox.nodes.get():
-                logging.debug(f"Looking for VMs on node {node['node']}.")
-                for vm in self.proxmox.nodes(node['node']).qemu.get():
-                    logging.debug(f"Found VM: {vm['name']}.")
-                    self.allvminfo[vm['vmid']] = vm
-                    self.allvminfo[vm['vmid']]['node'] = node['node']
-            logging.info(f"Found {len(self.allvminfo)} VMs.")
-            logging.info("Done creating dict of all VM info.")
-            logging.debug(f"All VM Info: {self.allvminfo}.")
+        if self.allvminfo is not None:
+            return self.allvminfo
+
+        with vmtypes.VMBuilder.init_lock:
+            if self.allvminfo is None:
+                allvminfo = self.loadAllVMInfo()
+                # Index by name as well: VM names are not unique in Proxmox.
+                vmsbyname = {}
+                for vmid, vm in allvminfo.items():
+                    vmsbyname.setdefault(vm['name'], []).append(vmid)
+                # Publish the name index first: concurrent builds only
+                # skip the lock once allvminfo is set.
+                self.vmsbyname = vmsbyname
+                self.allvminfo = allvminfo
         return self.allvminfo
 
+    def loadAllVMInfo(self):
+        """Return info on all VMs from the on-disk cache or the API."""
+        if not self.args.nocache:
+            cached = self.loadVMInfoCache(VMINFO_CACHE_TTL_SECS)
+            if cached is not None:
+                logging.info("Using cached info on %s VMs.", len(cached))
+                return cached
+
+        logging.info("Creating dict of all VM info.")
+        try:
+            allvminfo = self.fetchAllVMInfo()
+        except requests.exceptions.RequestException:
+            stale = None if self.args.nocache else self.loadVMInfoCache()
+            if stale is None:
+                raise
+            logging.warning("Unable to query Proxmox API for VM info, "
+                            "using stale cached copy.")
+            return stale
+
+        if not self.args.nocache:
+            self.saveVMInfoCache(allvminfo)
+        logging.info("Found %s VMs.", len(allvminfo))
+        logging.info("Done creating dict of all VM info.")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("All VM Info: %s.", allvminfo)
+        return allvminfo
+
+    def fetchAllVMInfo(self):
+        """Query the Proxmox API for all VMs on all nodes."""
+        allvminfo = {}
+        node_names = [node['node'] for node in self.proxmox.nodes.get()]
+        # One API round-trip per node; issue them concurrently.
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(PROXMOX_API_CONCURRENCY, len(node_names) or 1)) as executor:
+            node_vms = executor.map(
+                lambda node_name: self.proxmox.nodes(node_name).qemu.get(),
+                node_names)
+            for node_name, vms in zip(node_names, node_vms):
+                logging.debug("Looking for VMs on node %s.", node_name)
+                allvminfo.update(
+                    {vm['vmid']: {**vm, 'node': node_name} for vm in vms})
+        return allvminfo
+
     def checkTaskStatus(self, node, upid, timeout_secs):
         """given a task puid, check status and adhere to timeout."""
-        deadline_time = time.time() + timeout_secs
-        sleep_time = 10
-        while 1:
-            if time.time() > deadline_time:
-                logging.error(f"Timeout reached waiting on task {upid} on node {node}.")
-                sys.exit(1)
-            upid_status = self.proxmox.nodes(node).tasks(upid).status.get()
-            task_status = upid_status["status"]
-            if task_status == "running":
-                logging.info(f"Current task status: {upid_status['status']}; "
-                             f" PID: {upid_status['pid']}.")
-                logging.debug(f"Remaining time before task times out: "
-                              f"{deadline_time - time.time()} secs.")
-                time.sleep(sleep_time)
-                continue
-            exit_status = upid_status["exitstatus"]
-            if task_status == "stopped" and exit_status == "OK":
-                logging.info("Task exited OK.")
-                logging.debug(f"Return Value: {upid_status}.")
-                return
-
-            logging.error(f"Task status exited NOT OK: {exit_status}. Return Value: {upid_status}.")
-            sys.exit(1)
-
+        self.checkTasksStatus([(node, upid)], timeout_secs)
+
+    def checkTasksStatus(self, tasks, timeout_secs):
+        """given a list of (node, upid) tasks, wait for all to finish OK within timeout."""
+        deadline_time = time.monotonic() + timeout_secs
+        outstanding = list(tasks)
+        # Poll quickly at first so short tasks return promptly, then
+        # back off exponentially for long-running ones.
+        sleep_time = 0.5
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(PROXMOX_API_CONCURRENCY, len(outstanding) or 1)) as executor:
+            while outstanding:
+                if time.monotonic() > deadline_time:
+                    for node, upid in outstanding:
+                        logging.error("Timeout reached waiting on task %s on node %s.", upid, node)
+                    sys.exit(1)
+                statuses = executor.map(
+                    lambda task: self.proxmox.nodes(task[0]).tasks(task[1]).status.get(),
+                    outstanding)
+                running = []
+                for task, upid_status in zip(outstanding, statuses):
+                    task_status = upid_status["status"]
+                    if task_status == "running":
+                        logging.info("Current task status: %s;  PID: %s.",
+                                     upid_status['status'], upid_status['pid'])
+                        running.append(task)
+                        continue
+                    exit_status = upid_status["exitstatus"]
+                    if task_status == "stopped" and exit_status == "OK":
+                        logging.info("Task exited OK.")
+                        logging.debug("Return Value: %s.", upid_status)
+                        continue
+
+                    logging.error("Task status exited NOT OK: %s. Return Value: %s.",
+                                  exit_status, upid_status)
+                    sys.exit(1)
+
+                outstanding = running
+                if outstanding:
+                    logging.debug("Remaining time before tasks time out: %s secs.",
+                                  deadline_time - time.monotonic())
+                    time.sleep(sleep_time)
+                    sleep_time = min(sleep_time * 2, 10)
 
     def getNextVMId(self):
         """return next available VM ID."""
@@ -113,47 +247,53 @@ class ProxmoxUbuntuCloud(vmtypes.BaseVM):
             next_id = -1
         else:
             next_id = self.proxmox.cluster.nextid.get()
-            logging.info(f"Next available VM ID is {next_id}.")
+            logging.info("Next available VM ID is %s.", next_id)
         return next_id
 
     def normalizeVMState(self):
         """Delete VM if one of same name is found."""
-        existing_found = False
-        logging.info(f"Seeing if other VMs of same name {self.getVmName()} exist..")
-        if not bool(self.getAllVMInfo()):
-            # No VMs are found in the cluster.
+        vm_name = self.getVmName()
+        logging.info("Seeing if other VMs of same name %s exist..", vm_name)
+        all_vms = self.getAllVMInfo()
+        vmids = self.vmsbyname.get(vm_name)
+        if not vmids:
+            logging.info("Did not find pre-existing VM of name %s.", vm_name)
+            return
+
+        for vmid in vmids:
+            logging.info("Found VM%s with same name %s that already exists.", vmid, vm_name)
+
+        if self.args.dry_run:
+            for vmid in vmids:
+                logging.info("DRY RUN: Would have stopped, and deleted VM(%s) %s.", vmid, vm_name)
             return
 
-        for vmid, vmvalues in self.getAllVMInfo().items():
-            if self.getVmName() == vmvalues['name']:
-                logging.info(f"Found VM{vmid} with same name {self.getVmName()} that already exists.")
-                node = vmvalues['node']
-                if self.args.dry_run:
-                    logging.info(f"DRY RUN: Would have stopped, and deleted VM({vmid}) {self.getVmName()}.")
-                    continue
-                if self.args.deleteifexists:
-                    logging.info(f"Stopping existing VM({vmid}): {self.getVmName()}.")
-                    status = self.proxmox.nodes(node).qemu(vmid).status.stop.post()
-                    self.checkTaskStatus(node, status, self.args.timeout_secs)
-                    logging.info(f"Stopped existing VM({vmid}): {self.getVmName()}.")
-                    logging.info(f"Deleting existing VM({vmid}): {self.getVmName()}.")
-                    delete_options = {
-                        'purge': 1,
-                    }
-                    status = self.proxmox.nodes(node).qemu(vmid).delete(**delete_options)
-                    self.checkTaskStatus(node, status, self.args.timeout_secs)
-                    logging.debug(f"Finished deleting VM({vmid}): {self.getVmName()}.")
-                    return
-                else:
-                    logging.critical(
-                        f"Existing VM({vmid}) by that name already found, "
-                        f"but --deleteifexists flag not passed. Exiting.")
-                    existing_found = True
-
-        if existing_found:
+        if not self.args.deleteifexists:
+            for vmid in vmids:
+                logging.critical(
+                    "Existing VM(%s) by that name already found, "
+                    "but --deleteifexists flag not passed. Exiting.", vmid)
             sys.exit(1)
-        else:
-            logging.info(f"Did not find pre-existing VM of name {self.getVmName()}.")
+
+        # Stop, then delete, every match, waiting on each batch of tasks together.
+        nodes = {vmid: all_vms[vmid]['node'] for vmid in vmids}
+        for vmid in vmids:
+            logging.info("Stopping existing VM(%s): %s.", vmid, vm_name)
+        self.checkTasksStatus(
+            [(node, self.proxmox.nodes(node).qemu(vmid).status.stop.post())
+             for vmid, node in nodes.items()],
+            self.args.timeout_secs)
+        delete_options = {
+            'purge': 1,
+        }
+        for vmid in vmids:
+            logging.info("Deleting existing VM(%s): %s.", vmid, vm_name)
+        self.checkTasksStatus(
+            [(node, self.proxmox.nodes(node).qemu(vmid).delete(**delete_options))
+             for vmid, node in nodes.items()],
+            self.args.timeout_secs)
+        self.invalidateVMInfoCache()
+        logging.debug("Finished deleting VM(s) %s: %s.", vmids, vm_name)
 
         logging.debug("Done with normalizeVmState.")
 
@@ -162,10 +302,6 @@ class ProxmoxUbuntuCloud(vmtypes.BaseVM):
         # Proxmox uses the cloud disk image as the image itself for the VM.
         # We don't create a seperate disk image in this instance.
 
-    def getNetVMId(self):
-        """get next available VM id."""
-        self.proxmox.cluster.nextid.get()
-
     def getViableNode(self):
         """Return node name to install VM to."""
         # TODO: make this smarter than just picking the node that was passed
@@ -174,8 +310,8 @@ class ProxmoxUbuntuCloud(vmtypes.BaseVM):
         # nodes = [x['node'] for x in self.proxmox.nodes.get()]
         # logging.debug(f"Found viable nodes: {nodes}.")
         # return nodes[0]
-        node = self.args.vm_host.split(".")[0]
-        logging.debug(f"Found viable node: {node}.")
+        node = self.getNodeName()
+        logging.debug("Found viable node: %s.", node)
         return node
 
     def getNetworkConfig(self):
@@ -188,79 +324,80 @@ class ProxmoxUbuntuCloud(vmtypes.BaseVM):
         if not ip:
             return "ip=dhcp,ip6=auto"
 
-        ip_type = ipaddress.ip_address(ip)
-        ip_family=''
-        gw_type=''
-
-        if isinstance(ip_type, ipaddress.IPv4Address):
-            logging.info("Detected IPv4 static IP address.")
-            ip_family = 'ip'
-            gw_type = 'gw'
-        elif isinstance(ip_type, ipaddress.IPv6Address):
-            logging.info("Detected IPv6 static IP address.")
-            ip_family = 'ip6'
-            gw_type = 'gw6'
-        else:
-            logging.error(f'Unable to determine IP address type (v4 or v6) of IP address: {ip}.')
-            sys.exit(1)
+        # getIPAddress already returns a parsed ipaddress object.
+        ip_family, gw_type = IP_FAMILY_CONFIG[ip.version]
+        logging.info("Detected IPv%s static IP address.", ip.version)
 
         prefix_length = self.getPrefixLength(ip, self.getNetmask(), ip_family)
         ipconfig = f"{ip_family}={ip}/{prefix_length},{gw_type}={self.getGateway()}"
-        logging.debug(f"Network ipconfig0: {ipconfig}")
+        logging.debug("Network ipconfig0: %s", ipconfig)
         return ipconfig
 
     def getTemplateVMId(self, template_name):
         """return VM ID of VM template."""
         template_vms = {}
+        node_name = self.getNodeName()
         for vm in self.getAllVMInfo().values():
-            if 'template' in vm and self.getAllVMInfo()[vm['vmid']]['node'] == self.getNodeName():
+            if 'template' in vm and vm['node'] == node_name:
                 template_vms[vm['name']] = vm['vmid']
                 ## TODO: ADD template name to the logging call below.
-                logging.info(f"Found candidate template VM: {template_vms[vm['name']]}. ")
+                logging.info("Found candidate template VM: %s. ", template_vms[vm['name']])
         try:
             template_id = template_vms[template_name]
-            logging.info(f"Found template VM ID: {template_id} for {template_name}.")
+            logging.info("Found template VM ID: %s for %s.", template_id, template_name)
         except KeyError:
-            logging.error(f"Did not find a template VM for {template_name} on node requested for install.")
+            logging.error("Did not find a template VM for %s on node requested for install.", template_name)
             sys.exit(1)
         return template_id
 
     def getSSHKeys(self):
         """Given a path, read the SSH keys into a string."""
+        if self.sshkeys is not None:
+            return self.sshkeys
         if self.args.proxmox_sshkeys.startswith('http'):
-            sshkeys = requests.get(self.args.proxmox_sshkeys).text
+            response = self.getHttpSession().get(self.args.proxmox_sshkeys, timeout=5)
+            response.raise_for_status()
+            sshkeys = response.text
         else:
-            with open(self.args.proxmox_sshkeys, 'r') as f:
+            with open(self.args.proxmox_sshkeys, 'r', encoding='utf-8') as f:
                 sshkeys = f.read()
-        logging.debug(f"SSH keys as retrieved: {sshkeys}")
+        logging.debug("SSH keys as retrieved: %s", sshkeys)
+        self.sshkeys = sshkeys
         return sshkeys
 
     def executeVirtInstall(self):
         """Create VM. Set any options."""
-        new_vmid = self.getNextVMId()
         node = self.getViableNode()
-        logging.info(f"Beginning VM installation of ID:{new_vmid} on {node} of {self.getVmName()}.")
         template_vmid = self.getTemplateVMId(self.args.proxmox_template)
 
-        clone_options = {
-            'name': self.getVmName(),
-            'newid': new_vmid,
-            'full': 1,
-            'format': 'raw',
-            'storage': self.getVmStoragePoolName(),
-        }
-        logging.debug(f"Clone Options: {clone_options}.")
+        # The next free VM ID is only taken once the clone is submitted,
+        # so concurrent builds must not interleave the two.
+        with ProxmoxUbuntuCloud.clone_lock:
+            new_vmid = self.getNextVMId()
+            logging.info("Beginning VM installation of ID:%s on %s of %s.", new_vmid, node, self.getVmName())
+
+            clone_options = {
+                'name': self.getVmName(),
+                'newid': new_vmid,
+                'full': 1,
+                'format': 'raw',
+                'storage': self.getVmStoragePoolName(),
+            }
+            logging.debug("Clone Options: %s.", clone_options)
+
+            if self.args.dry_run:
+                logging.info("DRY RUN: Would have cloned VM %s to %s using template %s.",
+                             template_vmid, new_vmid, self.args.proxmox_template)
+            else:
+                clone_output = self.proxmox.nodes(node).qemu(template_vmid).clone.post(**clone_options)
+                logging.info("VM Cloning operation output: %s.", clone_output)
 
-        if self.args.dry_run:
-            logging.info(f"DRY RUN: Would have cloned VM {template_vmid} to "
-                         f"{new_vmid} using template {self.args.proxmox_template}.")
-        else:
-            clone_output = self.proxmox.nodes(node).qemu(template_vmid).clone.post(**clone_options)
-            logging.info(f"VM Cloning operation output: {clone_output}.")
+        if not self.args.dry_run:
             self.checkTaskStatus(
                 node,
                 clone_output,
                 self.args.timeout_secs)
+            self.invalidateVMInfoCache()
 
         resize_options = {
             'disk': "scsi0",
@@ -268,9 +405,9 @@ class ProxmoxUbuntuCloud(vmtypes.BaseVM):
         }
 
         if self.args.dry_run:
-            logging.info(f"DRY RUN: Would have resized disk on VM{new_vmid} with options: {resize_options}.")
+            logging.info("DRY RUN: Would have resized disk on VM%s with options: %s.", new_vmid, resize_options)
         else:
-            logging.info(f"Resizing disk on VM{new_vmid} with options: {resize_options}.")
+            logging.info("Resizing disk on VM%s with options: %s.", new_vmid, resize_options)
             self.proxmox.nodes(node).qemu(new_vmid).resize().put(**resize_options)
 
         vm_dict = {
@@ -291,16 +428,16 @@ class ProxmoxUbuntuCloud(vmtypes.BaseVM):
         if self.args.proxmox_sshkeys:
             vm_dict.update({'sshkeys': urllib.parse.quote(self.getSSHKeys(), safe='')})
 
-        logging.info(f"VM {new_vmid} options: {vm_dict}.")
+        logging.info("VM %s options: %s.", new_vmid, vm_dict)
 
         if not self.args.dry_run:
             ret_val = self.proxmox.nodes(node).qemu(new_vmid).config.post(**vm_dict)
-            logging.debug(f"VM return value: {ret_val}.")
-            logging.info(f"Done setting VM options.")
+            logging.debug("VM return value: %s.", ret_val)
+            logging.info("Done setting VM options.")
 
         if self.args.dry_run:
-            logging.info(f"DRY RUN: Would have started VM {self.getVmName()}.")
+            logging.info("DRY RUN: Would have started VM %s.", self.getVmName())
         else:
-            logging.info(f"Starting VM {self.getVmName()}.")
+            logging.info("Starting VM %s.", self.getVmName())
             self.proxmox.nodes(node).qemu(new_vmid).status.start.post()
-        logging.info(f"Completed install of VM {self.getVmName()}.")
+        logging.info("Completed install of VM %s.", self.getVmName())
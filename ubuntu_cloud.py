@@ -1,11 +1,18 @@
 """Ubuntu Cloud specific virtual machine builder library."""
+import concurrent.futures
+import contextvars
+import fcntl
+import functools
+import hashlib
 import logging
+import mmap
 import os
+import shutil
 import subprocess
+import threading
 import urllib
 import uuid
 from urllib.parse import urlparse
-import urllib.request
 
 import jinja2
 
@@ -17,63 +24,303 @@ RELEASE_TO_VER = {
     'disco': '19.04',
 }
 
+# Size of each read from an image download stream.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Compiled template bytecode, kept across runs.
+JINJA_CACHE_DIR = os.path.expanduser("~/.cache/virthelper/jinja")
+# Verified release images, stored by SHA256 and shared between pools. An
+# entry is a hard link where the pool shares its filesystem, else a copy.
+IMAGE_CACHE_DIR = os.path.expanduser("~/.cache/virthelper/images")
+
+def fileSha256(path):
+    """Return the hex SHA256 digest of the file at path."""
+    with open(path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+
+def verifyDownload(path, sha256):
+    """Raise IOError, removing path, if its SHA256 digest is not sha256."""
+    digest = fileSha256(path)
+    if digest != sha256:
+        os.remove(path)
+        raise IOError(f"Checksum mismatch for {path}: expected {sha256}, got {digest}.")
+    logging.debug("Verified SHA256 %s of %s.", digest, path)
+
+
+@functools.lru_cache(maxsize=32)
+def getReleaseManifest(session, sums_url):
+    """Fetch a SHA256SUMS file once per run; return a dict of filename to digest."""
+    resp = session.get(sums_url, timeout=30)
+    resp.raise_for_status()
+    manifest = {}
+    for line in resp.text.splitlines():
+        try:
+            # "<digest>  <file>" in text mode, "<digest> *<file>" in binary.
+            digest, filename = line.split(None, 1)
+        except ValueError:
+            continue
+        manifest[filename.lstrip("*")] = digest
+    return manifest
+
+
+def removePartial(partial):
+    """Remove a partly downloaded file, if it was created."""
+    try:
+        os.remove(partial)
+    except FileNotFoundError:
+        pass
+
+
+def linkOrCopy(src, dest):
+    """Hard link src to dest, copying instead when they are on different filesystems."""
+    try:
+        os.link(src, dest)
+    except OSError:
+        # Copy under a temporary name so dest is never left half written.
+        shutil.copyfile(src, f"{dest}.part")
+        os.replace(f"{dest}.part", dest)
+
+
+def parallelDownload(session, url, dest, workers=8, sha256=None):
+    """Download url to dest using concurrent HTTP range requests.
+
+    Falls back to a single streamed GET when the server does not
+    advertise byte-range support. The file is written to a '.part'
+    path and only renamed into place once complete, and, if sha256 is
+    given, once its checksum matches.
+    """
+    head = session.head(url, allow_redirects=True, timeout=30)
+    head.raise_for_status()
+    size = int(head.headers.get('Content-Length', 0))
+    partial = f"{dest}.part"
+
+    if head.headers.get('Accept-Ranges') != 'bytes' or size < workers:
+        logging.debug("Range requests unsupported for %s, using a single stream.", url)
+        try:
+            with session.get(head.url, stream=True, timeout=30) as resp:
+                resp.raise_for_status()
+                with open(partial, 'wb') as f:
+                    for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+        except BaseException:
+            removePartial(partial)
+            raise
+        if sha256:
+            verifyDownload(partial, sha256)
+        os.replace(partial, dest)
+        return
+
+    span = -(-size // workers)
+    ranges = [(lo, min(lo + span, size) - 1) for lo in range(0, size, span)]
+    logging.debug("Downloading %s bytes in %s ranges.", size, len(ranges))
+    # Set when any range fails, so the others stop at their next chunk.
+    failed = threading.Event()
+
+    def fetch(lo, hi):
+        """Write bytes lo..hi of the remote file at the same offset in dest."""
+        with session.get(head.url, headers={'Range': f'bytes={lo}-{hi}'},
+                          stream=True, timeout=30) as resp:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                raise IOError(f"Expected partial content for range {lo}-{hi}, "
+                              f"got HTTP {resp.status_code}.")
+            offset = lo
+            for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if failed.is_set():
+                    return
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+        if offset != hi + 1:
+            raise IOError(f"Short read on range {lo}-{hi}: stopped at {offset}.")
+
+    fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        os.ftruncate(fd, size)
+        futures = [executor.submit(fetch, lo, hi) for lo, hi in ranges]
+        # Surface the first failure as soon as it happens.
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    except BaseException:
+        failed.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        os.close(fd)
+        removePartial(partial)
+        raise
+    executor.shutdown()
+    os.close(fd)
+    if sha256:
+        verifyDownload(partial, sha256)
+    os.replace(partial, dest)
+
+
+@functools.lru_cache(maxsize=None)
+def getJinjaEnvironment():
+    """Return the shared jinja2 Environment for templates in the configs dir."""
+    try:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(
+            directory=JINJA_CACHE_DIR, pattern="%s.cache")
+    except OSError as err:
+        # The cache is only an optimisation; compile templates in memory.
+        logging.debug("Not caching template bytecode: %s.", err)
+        bytecode_cache = None
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(vmtypes.CONFIGS_DIR),
+        auto_reload=False,
+        cache_size=50,
+        bytecode_cache=bytecode_cache)
+
+
+@functools.lru_cache(maxsize=None)
+def getTemplate(template_name):
+    """Return the compiled jinja2 template template_name."""
+    return getJinjaEnvironment().get_template(template_name)
+
+
 class UbuntuCloud(vmtypes.BaseVM):
     """Ubuntu-Cloud specific configuration."""
 
     name = "UbuntuCloud"
     static_network_configured = False
+    # Release and golden images known to exist during this run, so
+    # later VMs skip re-checking them on disk.
+    downloaded_images = set()
+    golden_images = set()
+    # Per golden image path locks, so concurrent builds of the same
+    # release download and convert it only once.
+    golden_image_locks = {}
+    golden_image_locks_lock = threading.Lock()
 
     def __init__(self):
-        super(UbuntuCloud, self).__init__()
+        super().__init__()
+        image_basename = f"ubuntu-{self.getUbuntuReleaseDatestamp()}-minimal-cloudimg-amd64"
+        self.release_image_filename = f"{image_basename}.img"
+        self.release_image_url = (
+            f"https://cloud-images.ubuntu.com/minimal/releases/"
+            f"{self.getUbuntuRelease()}/release/{self.release_image_filename}")
+        self.golden_image_filename = f"{image_basename}-golden.img"
 
     def normalizeVMState(self):
         """get VM images in a state ready to be installed."""
-        super(UbuntuCloud, self).normalizeVMState()
-        self.deleteVMDirectory()
-        self.deleteVMSeedImage()
-        self.downloadUbuntuCloudImage()
-        self.createVmDirectory()
-        self.writeUserData()
-        self.writeMetaData()
-        self.writeNetworkConfigData()
-        self.createGoldenUbuntuCloudImage()
-        self.createVmSeedImage()
+        # Check for and delete any existing VM first, so a refusal to
+        # delete exits straight away instead of waiting on a download.
+        super().normalizeVMState()
+        # The release download and golden image convert only touch the
+        # shared release images, so overlap them with cleaning up and
+        # templating this VM and building its seed image. Once the golden
+        # image is ready, the same job creates the new disk image on top
+        # of it; it needs this VM's per-VM state to name the disk.
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            disk = executor.submit(contextvars.copy_context().run,
+                                   self.prepareVmDiskImage)
+            self.deleteVMDirectory()
+            self.deleteVMSeedImage()
+            self.createVmDirectory()
+            self.writeUserData()
+            self.writeMetaData()
+            self.writeNetworkConfigData()
+            self.createVmSeedImage()
+            disk.result()
+        finally:
+            # A download or convert already under way is not interrupted;
+            # it runs to completion in the background while the error
+            # propagates, and the process exits once it finishes.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def prepareVmDiskImage(self):
+        """prepare the golden image, then create the VM's disk image on top of it."""
+        self.prepareGoldenImage()
+        self.createVmDiskOverlay()
+
+    def prepareGoldenImage(self):
+        """download the release image and convert it to the golden image, once per release."""
+        if self.getGoldenImagePath() in UbuntuCloud.golden_images:
+            return
+        with UbuntuCloud.golden_image_locks_lock:
+            lock = UbuntuCloud.golden_image_locks.setdefault(
+                self.getGoldenImagePath(), threading.Lock())
+        with lock:
+            if self.args.dry_run:
+                self.downloadUbuntuCloudImage()
+                self.createGoldenUbuntuCloudImage()
+                return
+            # Also serialise against other virthelper processes using this
+            # pool. Lock the pool directory itself, so no lock file is left
+            # behind to show up as a volume.
+            pool_fd = os.open(self.getDiskPoolPath(), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                fcntl.flock(pool_fd, fcntl.LOCK_EX)
+                self.downloadUbuntuCloudImage()
+                self.createGoldenUbuntuCloudImage()
+            finally:
+                os.close(pool_fd)
 
     def getUbuntuReleaseDatestamp(self):
         return RELEASE_TO_VER[self.getUbuntuRelease()]
 
     def getUbuntuReleaseImageFilename(self):
         """Release cloud-image file name."""
-        return f"ubuntu-{self.getUbuntuReleaseDatestamp()}-minimal-cloudimg-amd64.img"
+        return self.release_image_filename
 
     def getReleaseImageDownloadPath(self):
         """remote url to download image file."""
-        return f"https://cloud-images.ubuntu.com/minimal/releases/{self.getUbuntuRelease()}/release/ubuntu-{self.getUbuntuReleaseDatestamp()}-minimal-cloudimg-amd64.img"
+        return self.release_image_url
 
-    def getReleaseImagePath(self):
+    def getReleaseImageChecksum(self):
+        """return the published SHA256 of the release image, or None if not listed."""
+        sums_url = urllib.parse.urljoin(self.getReleaseImageDownloadPath(), "SHA256SUMS")
+        digest = getReleaseManifest(self.getHttpSession(), sums_url).get(
+            self.getUbuntuReleaseImageFilename())
+        if not digest:
+            logging.warning("No checksum for %s in %s.", self.getUbuntuReleaseImageFilename(), sums_url)
+        return digest
+
+    @functools.cached_property
+    def release_image_path(self):
         return os.path.join(
             self.getDiskPoolPath(),
             self.getUbuntuReleaseImageFilename())
 
+    def getReleaseImagePath(self):
+        return self.release_image_path
+
     def getVmSeedImagePath(self):
         """return path to cloud vm seed image. containing meta/user data."""
         return os.path.join(
             self.getDiskPoolPath(),
             "%s-seed.img" % self.getVmName())
 
-    def getGoldenImagePath(self):
-        """return on-disk path of distro golden image file."""
+    @functools.cached_property
+    def golden_image_path(self):
         return os.path.join(
             self.getDiskPoolPath(),
-            f"ubuntu-{self.getUbuntuReleaseDatestamp()}-minimal-cloudimg-amd64-golden.img")
+            self.golden_image_filename)
+
+    def getGoldenImagePath(self):
+        """return on-disk path of distro golden image file."""
+        return self.golden_image_path
 
     def createGoldenUbuntuCloudImage(self):
         """create golden ubuntu cloud image to be used for installs."""
+        if self.getGoldenImagePath() in UbuntuCloud.golden_images:
+            return
         if os.path.exists(self.getGoldenImagePath()):
             logging.info("Golden Ubuntu release image already exists.")
+            UbuntuCloud.golden_images.add(self.getGoldenImagePath())
             return
+        # qemu-img defaults to 8 coroutines and caps them at 16. -S 4k
+        # keeps zeroed 4k blocks sparse.
+        coroutines = min(max(os.cpu_count() or 1, 8), 16)
         command_line = ["/usr/bin/qemu-img",
-                        "convert", "-O", "qcow2",
+                        "convert", "-m", str(coroutines), "-S", "4k",
+                        "-O", "qcow2",
                         self.getReleaseImagePath(),
                         self.getGoldenImagePath()]
         if self.args.dry_run:
@@ -83,98 +330,111 @@ class UbuntuCloud(vmtypes.BaseVM):
         try:
             output = subprocess.check_output(command_line,
                 stderr=subprocess.STDOUT)
-            logging.debug(f"Command line {command_line}; Output: {output}")
+            logging.debug("Command line %s; Output: %s", command_line, output)
+            UbuntuCloud.golden_images.add(self.getGoldenImagePath())
         except subprocess.CalledProcessError as err:
-            logging.critical(f"Error in creating image: {err.output}.")
+            logging.critical("Error in creating image: %s.", err.output)
+            raise vmtypes.HandledException("Golden image creation failed.") from err
 
     def downloadUbuntuCloudImage(self):
         """Download Ubuntu cloud image for specificed release."""
-        logging.info(f"Attempting to download {self.getUbuntuReleaseImageFilename()} to {self.getReleaseImagePath()}.")
+        if self.getReleaseImagePath() in UbuntuCloud.downloaded_images:
+            return
+        logging.info("Attempting to download %s to %s.", self.getUbuntuReleaseImageFilename(), self.getReleaseImagePath())
         if os.path.exists(self.getReleaseImagePath()):
             logging.info("Image already downloaded. Skipping.")
+            UbuntuCloud.downloaded_images.add(self.getReleaseImagePath())
             return
 
         if self.args.dry_run:
-            logging.info(f"DRY RUN: Would have retrieved new image {self.getUbuntuReleaseImageFilename()} "
-                         f"from {self.getReleaseImageDownloadPath()}.")
+            logging.info("DRY RUN: Would have retrieved new image %s from %s.",
+                         self.getUbuntuReleaseImageFilename(), self.getReleaseImageDownloadPath())
             return
+        sha256 = self.getReleaseImageChecksum()
+        cache_path = os.path.join(IMAGE_CACHE_DIR, f"{sha256}.img") if sha256 else None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                # The name alone does not prove the contents are intact.
+                verifyDownload(cache_path, sha256)
+            except IOError as err:
+                # verifyDownload has removed the bad entry; download afresh.
+                logging.warning("Discarding cached image: %s", err)
+            else:
+                logging.info("Using cached image %s.", cache_path)
+                linkOrCopy(cache_path, self.getReleaseImagePath())
+                UbuntuCloud.downloaded_images.add(self.getReleaseImagePath())
+                return
+
         logging.info("Beginning download of Ubuntu cloud image.")
-        urllib.request.urlretrieve(
+        parallelDownload(
+            self.getHttpSession(),
             self.getReleaseImageDownloadPath(),
-            self.getReleaseImagePath())
+            self.getReleaseImagePath(),
+            sha256=sha256)
+        UbuntuCloud.downloaded_images.add(self.getReleaseImagePath())
         logging.info("Finished downloading Ubuntu cloud image.")
+        if cache_path:
+            # A hard link when the pool shares a filesystem with the cache,
+            # otherwise a copy, as pools such as /var/lib/libvirt/images
+            # usually do not.
+            os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+            try:
+                linkOrCopy(self.getReleaseImagePath(), cache_path)
+            except OSError as err:
+                logging.warning("Not caching %s: %s.", self.getReleaseImagePath(), err)
 
     def createVmDirectory(self):
         """create a host-specific vm-store directory."""
-        if not os.path.exists(self.getVmDirectory()):
-            if self.args.dry_run:
-                logging.info(f"DRY RUN: Would have created created VM "
-                             f"directory: {self.getVmDirectory()}.")
-                return
-            logging.info(f"Creating VM directory: {self.getVmDirectory()}.")
-            os.mkdir(self.getVmDirectory())
+        if self.args.dry_run:
+            logging.info("DRY RUN: Would have created VM directory: %s.",
+                         self.getVmDirectory())
+            return
+        logging.info("Creating VM directory: %s.", self.getVmDirectory())
+        os.makedirs(self.getVmDirectory(), exist_ok=True)
 
     def writeNetworkConfigData(self):
         """write the cloud-config network config data file file."""
         # if network config data is true, add the flag and file to
         # cloud-localds run.
 
-        def render(template_file, context):
-            """Function to fill in variables in jinja2 template file."""
-            path, filename = os.path.split(template_file)
-            return jinja2.Environment(
-                loader=jinja2.FileSystemLoader(path)
-                ).get_template(filename).render(context)
-
         logging.debug("Checking if static networking is enabled.")
-        static_network = all([
-            self.getIPAddress(),
-            self.getNetmask(),
-            self.getGateway()])
-
-        network_config_vars = {}
-
-        logging.debug(f"Is static network configured? {static_network}.")
-
-        if static_network:
-            UbuntuCloud.static_network_configured = True
-            network_config_vars.update({
-                'static_network': True,
-                'dns': self.getNameserver(),
-                'gateway': self.getGateway(),
-                'ip_address': self.getIPAddress(),
-                'network_prefixlen': self.getPrefixLength(
-                    self.getIPAddress(),
-                    self.getNetmask()),
-            })
-        else:
+        ip_address = self.getIPAddress()
+        netmask = self.getNetmask()
+        gateway = self.getGateway()
+        static_network = all([ip_address, netmask, gateway])
+
+        logging.debug("Is static network configured? %s.", static_network)
+
+        if not static_network:
             return
 
-        network_config_template = os.path.join(
-            self.getConfigsDir(),
-            "network-config.yaml")
+        UbuntuCloud.static_network_configured = True
+        network_config_vars = {
+            'static_network': True,
+            'dns': self.getNameserver(),
+            'gateway': gateway,
+            'ip_address': ip_address,
+            'network_prefixlen': self.getPrefixLength(
+                ip_address,
+                netmask,
+                "ip" if ip_address.version == 4 else "ip6"),
+        }
 
-        template_rendered = render(network_config_template, network_config_vars)
+        template = getTemplate("network-config.yaml")
 
-        logging.debug(f"Rendered network-config config: {template_rendered}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Rendered network-config config: %s", template.render(network_config_vars))
 
         if self.args.dry_run:
             logging.info("DRY RUN: Did not actually write network-config.")
             return
 
         with open(os.path.join(self.getVmDirectory(), "network-config"), "w") as cc:
-            cc.write(template_rendered)
+            cc.writelines(template.generate(network_config_vars))
 
     def writeUserData(self):
         """write the cloud-config user-data file."""
 
-        def render(template_file, context):
-            """Function to fill in variables in jinja2 template file."""
-            path, filename = os.path.split(template_file)
-            return jinja2.Environment(
-                loader=jinja2.FileSystemLoader(path)
-                ).get_template(filename).render(context)
-
         user_data_vars = {
             'hostname': self.getVmHostName(),
             'fqdn': self.getVmName(),
@@ -183,50 +443,37 @@ class UbuntuCloud(vmtypes.BaseVM):
             'ldap_basedn': self.args.ldap_basedn,
         }
 
-        user_data_template = os.path.join(
-            self.getConfigsDir(),
-            "user-data.yaml")
+        template = getTemplate("user-data.yaml")
 
-        template_rendered = render(user_data_template, user_data_vars)
-
-        logging.debug(f"Rendered user-data config: {template_rendered}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Rendered user-data config: %s", template.render(user_data_vars))
 
         if self.args.dry_run:
             logging.info("DRY RUN: Did not actually write user-data.")
             return
 
         with open(os.path.join(self.getVmDirectory(), "user-data"), "w") as cc:
-            cc.write(template_rendered)
+            cc.writelines(template.generate(user_data_vars))
 
     def writeMetaData(self):
         """write the cloud-config meta-data file."""
 
-        def render(template_file, context):
-            """Function to fill in variables in jinja2 template file."""
-            path, filename = os.path.split(template_file)
-            return jinja2.Environment(
-                loader=jinja2.FileSystemLoader(path)
-                ).get_template(filename).render(context)
-
         meta_data_vars = {
             'vm_instance_id': uuid.uuid1(),
             'vm_hostname': self.getVmHostName()
         }
 
-        meta_data_template = os.path.join(
-            self.getConfigsDir(),
-            "meta-data.yaml")
-
-        template_rendered = render(meta_data_template, meta_data_vars)
+        template = getTemplate("meta-data.yaml")
 
-        logging.debug(f"Rendered meta-data config: {template_rendered}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Rendered meta-data config: %s", template.render(meta_data_vars))
         
         if self.args.dry_run:
             logging.info("DRY RUN: Did not actually write meta-data.")
             return
 
         with open(os.path.join(self.getVmDirectory(), "meta-data"), "w") as cc:
-            cc.write(template_rendered)
+            cc.writelines(template.generate(meta_data_vars))
 
     def createVmSeedImage(self):
         """create VM seed image containing user/meta data."""
@@ -249,72 +496,70 @@ class UbuntuCloud(vmtypes.BaseVM):
                             os.path.join(self.getVmDirectory(), "meta-data")]
 
 
-        logging.debug(f"cloud-localds command line: {command_line}")
+        logging.debug("cloud-localds command line: %s", command_line)
 
         if self.args.dry_run:
-            logging.info(f"DRY RUN. Would have run: {command_line}.")
+            logging.info("DRY RUN. Would have run: %s.", command_line)
             return
         try:
             output = subprocess.check_output(command_line,
                 stderr=subprocess.STDOUT)
-            logging.debug(f"Command line {command_line}; Output: {output}")
+            logging.debug("Command line %s; Output: %s", command_line, output)
         except subprocess.CalledProcessError as err:
             logging.critical("Error in creating image: %s.", err.output)
+            raise vmtypes.HandledException("Golden image creation failed.") from err
             raise
 
     def deleteVMSeedImage(self):
         """delete VM seed image."""
         if self.args.dry_run:
-            logging.info(f"DRY RUN: Would have tried to delete seed image: {self.getVmSeedImagePath()}.")
+            logging.info("DRY RUN: Would have tried to delete seed image: %s.", self.getVmSeedImagePath())
             return
 
-        if not os.path.exists(self.getVmSeedImagePath()):
+        seed_image_path = self.getVmSeedImagePath()
+        try:
+            os.remove(seed_image_path)
+        except FileNotFoundError:
             logging.info("No seed image found to delete.")
             return
+        logging.info("Deleted VM seed image: %s.", seed_image_path)
 
-        logging.info(f"Deleting VM seed image: {self.getVmSeedImagePath()}.")
-        os.remove(self.getVmSeedImagePath())
-        logging.info("Done deleting VM seed image.")
-
-    def createDiskImage(self):
-        """Create a qcow2 disk image using Ubuntu Cloud golden image."""
+    def runDiskImageCommand(self, command_line):
+        """run a disk image command, raising HandledException on failure."""
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("executing: %s", " ".join(command_line))
+        if self.args.dry_run:
+            logging.info("DRY RUN: Did not actually execute.")
+            return
+        try:
+            # NO shell=true here.
+            output = subprocess.check_output(command_line,
+                                             stderr=subprocess.STDOUT,
+                                             close_fds=False)
+            logging.debug("Disk image command output: %s.", output)
+        except subprocess.CalledProcessError as err:
+            logging.critical("Error in creating disk image: %s.", err.output)
+            raise vmtypes.HandledException("Disk image command failed.") from err
 
+    def createVmDiskOverlay(self):
+        """create the VM's qcow2 disk image backed by the golden image."""
         logging.info("Creating disk image for Ubuntu Cloud host %s.",
                      self.getVmName())
+        self.runDiskImageCommand(
+            ("/usr/bin/qemu-img", "create", "-f", "qcow2",
+             "-b", self.getGoldenImagePath(),
+             self.getVmDiskImagePath(),
+             f"{self.getDiskSize()}G"))
 
-        commands = []
-        command_line = ["/usr/bin/qemu-img", "create", "-f", "qcow2"]
-        command_line.extend(["-b",
-                             self.getGoldenImagePath()])
-        command_line.extend([self.getVmDiskImagePath()])
-        command_line.extend(["%dG" % self.getDiskSize()])
-        logging.debug("qemu-img command line: %s", " ".join(command_line))
-        commands.extend([command_line])
-
-        command_line = ["/usr/bin/virsh", "pool-refresh",
-                        "--pool", self.getVmStoragePoolName()]
-        commands.extend([command_line])
-
-        command_line = ["/usr/bin/virsh", "vol-upload",
-                        "--vol", os.path.basename(self.getVmDiskImagePath()),
-                        "--pool", self.getVmStoragePoolName(),
-                        "--file", self.getVmDiskImagePath()]
-        commands.extend([command_line])
-
-        try:
-            # NO shell=true here.
-            logging.info("Creating and uploading Ubuntu Minimal VM disk image.")
-            for current in commands:
-                logging.debug("executing: %s", " ".join(current))
-                if self.args.dry_run:
-                    logging.info("DRY RUN: Did not actually execute.")
-                    continue
-                output = subprocess.check_output(current,
-                                                 stderr=subprocess.STDOUT)
-                logging.info("Disk image created successfully.")
-                logging.debug(f"Disk image creation output: {output}.")
-        except subprocess.CalledProcessError as err:
-            logging.critical(f"Error in creating disk image: {err.output}.")
+    def createDiskImage(self):
+        """Make the qcow2 disk image created during normalizeVMState visible in its pool."""
+        # qemu-img already wrote the image into the pool's directory, so
+        # the pool only needs to rescan it.
+        logging.info("Adding Ubuntu Minimal VM disk image to pool.")
+        if self.args.dry_run:
+            logging.info("DRY RUN: Did not refresh pool %s.", self.getVmStoragePoolName())
+            return
+        self.getStoragePool().refresh(0)
 
     def getVirtInstallCustomFlags(self):
         return {
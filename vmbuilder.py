@@ -5,10 +5,8 @@ import logging
 import os
 import sys
 
-from vmtypes import VMBuilder
-
-def parseArgs():
-    """Parse and return command line flags."""
+def buildParser():
+    """Build the command line flag parser."""
     parser = argparse.ArgumentParser(
         description="Building libvirt and Proxmox virtual machines, made easy.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -36,6 +34,12 @@ def parseArgs():
                         type=int,
                         help=("Create a number of VM instances. "
                               "Default: %(default)s"))
+    parser.add_argument("--jobs",
+                        default=1,
+                        type=int,
+                        help=("Number of cluster VMs to build concurrently. "
+                              "Each build opens its own SSH sessions to the "
+                              "VM host. Default: %(default)s"))
     parser.add_argument("--cluster_start_index",
                         default=0,
                         type=int,
@@ -128,13 +132,25 @@ def parseArgs():
     proxmox_args.add_argument("--proxmox_sshkeys",
                               help="SSH keys to install on VM.")
     proxmox_args.add_argument("--noverify_ssl",
+                              dest="verify_ssl",
                               action="store_false",
                               help="Disable verifying SSL certificate on Proxmox API endpoint.")
+    proxmox_args.add_argument("--nocache",
+                              action="store_true",
+                              help="Disable the short-lived on-disk cache of Proxmox VM info.")
+    return parser
+
+
+PARSER = buildParser()
 
-    args = parser.parse_args()
+
+def parseArgs():
+    """Parse and return command line flags."""
+    args = PARSER.parse_args()
     startup_errors = False
     network_args = [args.ip_address, args.nameserver, args.gateway, args.netmask]
-    if any(network_args) and not all(network_args):
+    given = sum(1 for arg in network_args if arg)
+    if 0 < given < len(network_args):
         logging.critical("To configure static networking, IP address, "
                          "nameserver, netmask, and gateway are ALL required,")
         startup_errors = True
@@ -145,6 +161,10 @@ def parseArgs():
                       "--ldap_basedn.")
         startup_errors = True
 
+    if args.jobs < 1:
+        logging.fatal("--jobs must be at least 1.")
+        startup_errors = True
+
     if args.config and not os.path.exists(args.config):
         logging.fatal(f"Specified config {args.config} does not exist.")
         startup_errors = True
@@ -162,16 +182,30 @@ def main():
 
     args = parseArgs()
 
+    # vmtypes pulls in libvirt, requests and netaddr. Import it only once the
+    # flags have parsed, so --help and flag errors do not pay for it.
+    from vmtypes import HandledException, VMBuilder
+
     vm = VMBuilder(args)
 
     if vm.args.command == 'list_disk_pools':
-        print(vm.getDiskPools())
+        conn = vm.getConn(readonly=True)
+        sys.stdout.write("".join(f"{name}\n" for name in vm.getDiskPools(conn)))
+    elif vm.args.command == 'list_network_interfaces':
+        conn = vm.getConn(readonly=True)
+        sys.stdout.write("".join(f"{name}\n" for name in vm.getNetworkInterfaces(conn)))
     elif vm.args.command == 'list_pool_volumes':
-        print(vm.getDiskPoolVolumes())
+        pool = vm.getConn(readonly=True).storagePoolLookupByName(
+            vm.getVmStoragePoolName())
+        sys.stdout.write("".join(f"{name}\n" for name in vm.getDiskPoolVolumes(pool)))
     elif vm.args.command == 'create_vm':
         logging.debug("about to run vm.getbuild.createvm")
         vm.verifyMinimumCreateVMArgs()
-        vm.getBuild().createVM()
+        try:
+            vm.getBuild().createVM()
+        except HandledException:
+            # Already logged where it was raised.
+            return 1
     else:
         logging.critical("The command you entered is not recognized.")
 
@@ -1,46 +1,97 @@
 """VM-specific configuration for using vmbuilder wrapper."""
+import atexit
+import concurrent.futures
+import contextvars
 import ipaddress
+import itertools
 import logging
 import os
+import shlex
 import shutil
 import subprocess
 import sys
+import threading
 import time
 from urllib.parse import urlparse
 import uuid
+from xml.etree import ElementTree
 
 import libvirt
-from bs4 import BeautifulSoup
 import netaddr
+import requests
+from requests.adapters import HTTPAdapter, Retry
 
 # NEXT: test overlay network flag
 
-class VMBuilder(object):
+# Static debian-installer kernel arguments shared by every preseeded install.
+PRESEED_EXTRA_ARGS = {
+    "keyboard-configuration/xkb-keymap": "us",
+    "console-setup/ask_detect": "false",
+    "locale": "en_US",
+}
+PRESEED_ADD_ONS = "serial console=tty0 console=ttyS0,9600n8"
+# virt-install invocation and options common to every VM.
+VIRT_INSTALL_COMMAND = (
+    "/usr/bin/virt-install", "--autostart",
+    "--nographics",
+    "--console", "pty,target_type=serial",
+)
+
+# Open libvirt connections, by URI, shared by every builder in the process.
+LIBVIRT_CONNECTIONS = {}
+
+
+def closeConnections():
+    """Close all open libvirt connections."""
+    while LIBVIRT_CONNECTIONS:
+        _, conn = LIBVIRT_CONNECTIONS.popitem()
+        try:
+            conn.close()
+        except libvirt.libvirtError as err:
+            logging.debug("Error closing libvirt connection: %s.", err)
+
+
+atexit.register(closeConnections)
+
+CONFIGS_DIR = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "configs")
+
+class HandledException(Exception):
+    """Raised for errors that have already been logged."""
+    __slots__ = ()
+
+
+class VMBuilder:
     """Class to marshall build of a VM."""
 
     build = None
-    conn = None
-    pool_path = None
-    vm_hostname = None
-    cluster_index = 0
+    http_session = None
+    # Disk pool paths and libvirt pool handles, keyed by (VM host, pool name).
+    pool_paths = {}
+    storage_pools = {}
+    # Per-VM state. Each cluster member is built in its own context, so
+    # concurrent builds do not see each other's host name or index.
+    vm_hostname = contextvars.ContextVar("vm_hostname", default=None)
+    vm_name = contextvars.ContextVar("vm_name", default=None)
+    vm_disk_image_name = contextvars.ContextVar("vm_disk_image_name", default=None)
+    cluster_index = contextvars.ContextVar("cluster_index", default=0)
     args = None
     virt_install_flag_updates = {}
     cluster_vm_suffixes = []
     base_mac_address = None
+    base_virt_install_flags = None
+    ssh_keys = None
+    # Guards lazy initialization of the shared class-level state above.
+    init_lock = threading.RLock()
 
     def __init__(self, args):
         VMBuilder.args = args
         self.configureLogging()
 
-    def setArgs(self):
-        """Parse command-line arguments into object variable."""
-        self.args = self.parseArgs()
-
     def getConfigsDir(self):
         """return on-disk path to where virthelper configs are."""
-        return os.path.join(os.path.dirname(
-            os.path.realpath(__file__)),
-            "configs")
+        return CONFIGS_DIR
 
     def getDefaultUser(self):
         """return the default username for the virtual machine."""
@@ -52,11 +103,11 @@ class VMBuilder(object):
 
     def setClusterIndex(self, c_index):
         """Set index of cluster VM being created."""
-        VMBuilder.cluster_index = c_index
+        VMBuilder.cluster_index.set(c_index)
 
     def getClusterIndex(self):
         """Get index of cluster VM being created."""
-        return VMBuilder.cluster_index
+        return VMBuilder.cluster_index.get()
 
     def getVmHost(self):
         """Get VM hostname containing VMs."""
@@ -71,7 +122,7 @@ class VMBuilder(object):
         VMBuilder.cluster_vm_suffixes = list(range(
             self.args.cluster_start_index,
             self.args.cluster_start_index + self.getClusterSize()))
-        logging.info(f"Set cluster_vm_suffixes: {VMBuilder.cluster_vm_suffixes}.")
+        logging.info("Set cluster_vm_suffixes: %s.", VMBuilder.cluster_vm_suffixes)
 
     def getClusterVmSuffix(self, host_index):
         """given an index, return the Vm suffix from the list of suffixes."""
@@ -83,26 +134,27 @@ class VMBuilder(object):
         If the cluster_size is 1, just return the hostname.
         There is no reason to index a hostname if there is only one.
         """
-        if cluster_size == 1:
-            VMBuilder.vm_hostname = host_name
-            return
-
-        host_name = host_name.split(".")[0]
-        host_suffix = self.getClusterVmSuffix(host_index)
-        newname = "%s%d" % (host_name, host_suffix)
-        VMBuilder.vm_hostname = newname
+        if cluster_size != 1:
+            host_name = "%s%d" % (host_name.partition(".")[0],
+                                  self.getClusterVmSuffix(host_index))
+        VMBuilder.vm_hostname.set(host_name)
+        # The FQDN and disk image name are used throughout a build; format
+        # them once.
+        vm_name = f"{host_name}.{self.getVmDomainName()}"
+        VMBuilder.vm_name.set(vm_name)
+        VMBuilder.vm_disk_image_name.set(f"{vm_name}.qcow2")
 
     def getVmHostName(self):
         """Return host name of VM."""
-        return VMBuilder.vm_hostname
+        return VMBuilder.vm_hostname.get()
 
     def getVmName(self):
         """Return FQDN of VM."""
-        return "%s.%s" % (self.getVmHostName(), self.getVmDomainName())
+        return VMBuilder.vm_name.get()
 
     def getVmDiskImageName(self):
         """Given a VM name, return the disk image base name."""
-        return "%s.qcow2" % self.getVmName()
+        return VMBuilder.vm_disk_image_name.get()
 
     def getVmDomainName(self):
         """Return domain name of VM."""
@@ -165,60 +217,112 @@ class VMBuilder(object):
         if VMBuilder.build:
             return VMBuilder.build
 
-        if self.getVmType() == 'ubuntu':
-            VMBuilder.build = Ubuntu()
-        elif self.getVmType() == 'debian':
-            VMBuilder.build = Debian()
-        elif self.getVmType() == 'ubuntu-cloud':
-            import ubuntu_cloud
-            VMBuilder.build = ubuntu_cloud.UbuntuCloud()
-        elif self.getVmType() == 'proxmox-ubuntu-cloud':
-            import proxmox_ubuntu_cloud
-            VMBuilder.build = proxmox_ubuntu_cloud.ProxmoxUbuntuCloud()
+        with VMBuilder.init_lock:
+            if VMBuilder.build:
+                return VMBuilder.build
+
+            if self.getVmType() == 'ubuntu':
+                VMBuilder.build = Ubuntu()
+            elif self.getVmType() == 'debian':
+                VMBuilder.build = Debian()
+            elif self.getVmType() == 'ubuntu-cloud':
+                import ubuntu_cloud
+                VMBuilder.build = ubuntu_cloud.UbuntuCloud()
+            elif self.getVmType() == 'proxmox-ubuntu-cloud':
+                import proxmox_ubuntu_cloud
+                VMBuilder.build = proxmox_ubuntu_cloud.ProxmoxUbuntuCloud()
 
         return VMBuilder.build
 
-    def getConn(self):
-        """Create or return libvirt connection to VM host."""
-        if VMBuilder.conn:
-            return VMBuilder.conn
+    def getConn(self, readonly=False):
+        """Create or return libvirt connection to VM host.
 
-        VMBuilder.conn = libvirt.open(
-            f"qemu+ssh://{self.args.vm_host}/system")
-        return VMBuilder.conn
-
-    def getDiskPools(self):
+        Read-only connections are for commands that only list host state.
+        """
+        uri = f"qemu+ssh://{self.args.vm_host}/system"
+        key = (uri, readonly)
+        conn = LIBVIRT_CONNECTIONS.get(key)
+        if conn is not None:
+            return conn
+
+        with VMBuilder.init_lock:
+            if key not in LIBVIRT_CONNECTIONS:
+                if readonly:
+                    LIBVIRT_CONNECTIONS[key] = libvirt.openReadOnly(uri)
+                else:
+                    LIBVIRT_CONNECTIONS[key] = libvirt.open(uri)
+        return LIBVIRT_CONNECTIONS[key]
+
+    def getHttpSession(self):
+        """Create or return the keep-alive HTTP session shared by all fetches."""
+        if VMBuilder.http_session is not None:
+            return VMBuilder.http_session
+
+        with VMBuilder.init_lock:
+            if VMBuilder.http_session is None:
+                session = requests.Session()
+                # Images are already compressed; don't ask for it again.
+                session.headers['Accept-Encoding'] = 'identity'
+                session.mount("https://", HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=8,
+                    max_retries=Retry(total=5, backoff_factor=0.3,
+                                      status_forcelist=[502, 503, 504])))
+                VMBuilder.http_session = session
+        return VMBuilder.http_session
+
+    def getDiskPools(self, conn=None):
         """Return list of disk pools on VM host."""
-        return [current.name() for current in
-                self.getConn().listAllStoragePools()]
+        if conn is None:
+            conn = self.getConn()
+        return [current.name() for current in conn.listAllStoragePools(0)]
+
+    def getNetworkInterfaces(self, conn=None):
+        """Return list of network interfaces on VM host."""
+        if conn is None:
+            conn = self.getConn()
+        return [current.name() for current in conn.listAllInterfaces(0)]
 
     def getDiskPoolPath(self):
         """Return the absolute path for the VM's disk pool."""
-        # TODO(jforman): Can you get disk pool XML via the API?
-        # Does this provide for using remote host?
-        if not self.pool_path is None:
-            logging.debug("Returning cached pool path.")
-            return self.pool_path
-
-        command_line = ["/usr/bin/virsh",
-                        "pool-dumpxml",
-                        self.getVmStoragePoolName()]
-        try:
-            output = subprocess.check_output(command_line,
-                                             stderr=subprocess.STDOUT)
-            logging.debug(f"Command line {command_line}; Output: {output}.")
-        except subprocess.CalledProcessError as err:
-            logging.critical(f"Error in creating disk image: {err.output}.")
-        soup = BeautifulSoup(output, "lxml")
-        self.pool_path = soup.target.path.string
-        return self.pool_path
-
-    def getDiskPoolVolumes(self):
+        key = (self.getVmHost(), self.getVmStoragePoolName())
+        pool_path = VMBuilder.pool_paths.get(key)
+        if pool_path is not None:
+            return pool_path
+
+        with VMBuilder.init_lock:
+            pool_path = VMBuilder.pool_paths.get(key)
+            if pool_path is None:
+                pool_xml = self.getStoragePool().XMLDesc(0)
+                logging.debug("Pool %s XML: %s.", self.getVmStoragePoolName(), pool_xml)
+                pool_path = ElementTree.fromstring(pool_xml).findtext("target/path")
+                VMBuilder.pool_paths[key] = pool_path
+        return pool_path
+
+    def getStoragePool(self):
+        """Create or return libvirt storage pool handle for the VM's disk pool."""
+        key = (self.getVmHost(), self.getVmStoragePoolName())
+        pool = VMBuilder.storage_pools.get(key)
+        if pool is not None:
+            return pool
+
+        with VMBuilder.init_lock:
+            pool = VMBuilder.storage_pools.get(key)
+            if pool is None:
+                pool = self.getConn().storagePoolLookupByName(
+                    self.getVmStoragePoolName())
+                # Pick up volumes written outside libvirt, once per run.
+                pool.refresh(0)
+                VMBuilder.storage_pools[key] = pool
+        return pool
+
+    def getDiskPoolVolumes(self, pool=None):
         """Return list of all volumes in specified disk pool."""
-        logging.debug(f"Getting volumes for pool {self.getVmStoragePoolName()}.")
-        volumes = [x.name() for x in self.getConn().storagePoolLookupByName(
-            self.getVmStoragePoolName()).listAllVolumes()]
-        logging.debug(f"Volumes in pool {self.getVmStoragePoolName()}: {volumes}.")
+        logging.debug("Getting volumes for pool %s.", self.getVmStoragePoolName())
+        if pool is None:
+            pool = self.getStoragePool()
+        volumes = [x.name() for x in pool.listAllVolumes()]
+        logging.debug("Volumes in pool %s: %s.", self.getVmStoragePoolName(), volumes)
         return volumes
 
     def getMacAddress(self):
@@ -228,23 +332,25 @@ class VMBuilder(object):
            Otherwise, generate one.
         """
         if not VMBuilder.base_mac_address:
-            if self.args.mac_address:
-                try:
-                    VMBuilder.base_mac_address = netaddr.EUI(self.args.mac_address)
-                except netaddr.core.AddrFormatError:
-                    logging.fatal(f"Invalid MAC Address provided on command line: {self.args.mac_address}")
-                    raise
-            else:
-                VMBuilder.base_mac_address = netaddr.EUI(uuid.uuid4().fields[5])
-
-        logging.info(f"Base MAC Address: {VMBuilder.base_mac_address}.")
+            with VMBuilder.init_lock:
+                if not VMBuilder.base_mac_address:
+                    if self.args.mac_address:
+                        try:
+                            VMBuilder.base_mac_address = netaddr.EUI(self.args.mac_address)
+                        except netaddr.core.AddrFormatError:
+                            logging.fatal("Invalid MAC Address provided on command line: %s", self.args.mac_address)
+                            raise
+                    else:
+                        VMBuilder.base_mac_address = netaddr.EUI(uuid.uuid4().fields[5])
+
+        logging.info("Base MAC Address: %s.", VMBuilder.base_mac_address)
         mac_obj = VMBuilder.base_mac_address
         mac_int = int(mac_obj)
         mac_int_indexed = mac_int+self.getClusterIndex()
         mac_indexed = str(netaddr.EUI(mac_int_indexed)).replace("-", ":").lower()
         # Unicast MACs, required by Proxmox, start with 00.
         mac_indexed= "00" + mac_indexed[2:].lower()
-        logging.info(f"Instance-specific MAC Address: {mac_indexed}.")
+        logging.info("Instance-specific MAC Address: %s.", mac_indexed)
         return mac_indexed
 
     def getIPAddressFamily(self, ip):
@@ -256,8 +362,9 @@ class VMBuilder(object):
         if isinstance(ip_address_class, ipaddress.IPv6Address):
             return "ipv6"
 
-        logging.fatal(f"Unable to determine IP address family for IP {ip}.")
-        raise
+        logging.fatal("Unable to determine IP address family for IP %s.", ip)
+        raise HandledException(f"Unknown IP address family for {ip}.")
+
     def getIPAddress(self):
         """
         If only one host, return IP address.
@@ -272,16 +379,16 @@ class VMBuilder(object):
         base_ip_address = ipaddress.ip_address(
             self.args.ip_address)
 
-        logging.debug(f"Base IP Address: {base_ip_address}.")
+        logging.debug("Base IP Address: %s.", base_ip_address)
 
         indexed_ip_address = base_ip_address + self.getClusterIndex()
-        logging.info(f"Indexed ({self.getClusterIndex()}) IP address for host: {indexed_ip_address}.")
+        logging.info("Indexed (%s) IP address for host: %s.", self.getClusterIndex(), indexed_ip_address)
         return indexed_ip_address
 
     def getPrefixLength(self, ip_address, netmask, ip_family):
         """Given an IP address and netmask, return integer prefix length."""
         composed_address = f"{ip_address}/{netmask}"
-        logging.debug(f"Determing network prefix length of {composed_address}.")
+        logging.debug("Determing network prefix length of %s.", composed_address)
         if ip_family == "ip":
             return ipaddress.IPv4Network(composed_address, strict=False).prefixlen
         if ip_family == "ip6":
@@ -299,23 +406,26 @@ class VMBuilder(object):
         """Return IP of default gateway."""
         return self.args.gateway
 
-    def getDefinedVMs(self):
-        """Return list of all VM names on a VM host."""
-        domains = [x.name() for x in self.getConn().listAllDomains()]
-        return domains
-
     def getSshKey(self):
         """Returns contents of Public SSH Key."""
-        homedir = os.environ['HOME']
+        if VMBuilder.ssh_keys is not None:
+            return VMBuilder.ssh_keys
+
+        ssh_dir = os.path.join(os.environ['HOME'], ".ssh")
         key_files = ['id_dsa.pub', 'id_rsa.pub', 'authorized_keys']
+        try:
+            with os.scandir(ssh_dir) as entries:
+                present = {entry.name for entry in entries if entry.is_file()}
+        except FileNotFoundError:
+            present = set()
         keys = []
         for current_kf in key_files:
-            cf = os.path.join(homedir, ".ssh", current_kf)
-            if os.path.exists(cf):
-                with open(cf, 'r') as f:
-                    keys.extend(x.strip() for x in f.readlines() if x != "\n")
+            if current_kf in present:
+                with open(os.path.join(ssh_dir, current_kf), 'r') as f:
+                    keys.extend(x.strip() for x in f if x != "\n")
         if not keys:
             logging.fatal("Unable to read any SSH keys. Do you need to create one?")
+        VMBuilder.ssh_keys = keys
         return keys
 
     def getUbuntuRelease(self):
@@ -329,42 +439,45 @@ class VMBuilder(object):
 
     def createDiskImage(self):
         """Create a qcow2 disk image."""
-        # TOOD: Figure out an API-ish way to create volume since
-        #  vol-create-as does not support providing a --connect flag
-        #  (["--connect", "qemu+ssh://%s/system" % self.args.vm_host])
+        volume = ElementTree.Element("volume")
+        ElementTree.SubElement(volume, "name").text = self.getVmDiskImageName()
+        ElementTree.SubElement(volume, "capacity", unit="G").text = str(self.getDiskSize())
+        target = ElementTree.SubElement(volume, "target")
+        ElementTree.SubElement(target, "format", type="qcow2")
+        volume_xml = ElementTree.tostring(volume, encoding="unicode")
 
-        command_line = (
-            f"/usr/bin/virsh vol-create-as "
-            f"--pool {self.getVmStoragePoolName()} "
-            f"--name {self.getVmDiskImageName()} "
-            f"--capacity {self.GetDiskSize()}G "
-            f"--format qcow2 "
-            f"--prealloc-metadata")
-
-        logging.debug(f"Create disk image command line: {command_line}")
+        logging.debug("Create disk image volume XML: %s", volume_xml)
 
         if self.args.dry_run:
             logging.info("DRYRUN: No disk image was created.")
             return
 
         try:
-            # NO shell=true here.
-            output = subprocess.check_output(command_line,
-                                             stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as err:
-            logging.error(f"Error in creating disk image: {err.output}.")
+            # Create the volume over the existing libvirt connection,
+            # rather than through a separate virsh process and connection.
+            volume = self.getStoragePool().createXML(
+                volume_xml, libvirt.VIR_STORAGE_VOL_CREATE_PREALLOC_METADATA)
+        except libvirt.libvirtError as err:
+            logging.error("Error in creating disk image: %s.", err)
             raise
         logging.info("Disk image created successfully.")
-        logging.debug(f"Disk image creation output: {output}.")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            # path() is another round-trip to the VM host.
+            logging.debug("Disk image created at: %s.", volume.path())
 
     def deleteVMImage(self):
         """Delete a VM's disk image."""
         logging.info("Checking for pre-existing disk image for this VM.")
-        if self.getVmDiskImageName() not in self.getDiskPoolVolumes():
+        try:
+            volume = self.getStoragePool().storageVolLookupByName(
+                self.getVmDiskImageName())
+        except libvirt.libvirtError as err:
+            if err.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL:
+                raise
             logging.info("VM image does not exist for VM. Nothing to delete.")
             return
 
-        logging.info(f"Attempting to delete image in pool {self.getVmStoragePoolName()} for vm {self.getVmName()}")
+        logging.info("Attempting to delete image in pool %s for vm %s", self.getVmStoragePoolName(), self.getVmName())
         if self.args.dry_run:
             logging.info("DRY RUN: Disk image not actually deleted.")
             return
@@ -374,9 +487,7 @@ class VMBuilder(object):
                           "not passed.")
             sys.exit(1)
 
-        self.getConn().storagePoolLookupByName(
-            self.args.disk_pool_name).storageVolLookupByName(
-                self.getVmDiskImageName()).delete()
+        volume.delete()
         logging.info("Finished deleting VM image for VM.")
 
     def deleteVM(self):
@@ -385,7 +496,11 @@ class VMBuilder(object):
             logging.info("DRY RUN: VM would have been deleted here.")
             return
 
-        if self.getVmName() not in self.getDefinedVMs():
+        try:
+            dom = self.getConn().lookupByName(self.getVmName())
+        except libvirt.libvirtError as err:
+            if err.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
             logging.info("VM does not already exist. No VM to delete.")
             return
 
@@ -394,9 +509,9 @@ class VMBuilder(object):
             logging.fatal("VM image found, but --deleteifexists "
                           "flag not passed.")
 
-        if self.getConn().lookupByName(self.getVmName()).isActive():
-            self.getConn().lookupByName(self.getVmName()).destroy()
-        self.getConn().lookupByName(self.getVmName()).undefine()
+        if dom.isActive():
+            dom.destroy()
+        dom.undefine()
 
     def deleteVMDirectory(self):
         """Delete a VM directory underneath the disk-pool."""
@@ -405,17 +520,17 @@ class VMBuilder(object):
             self.getVmName())
 
         if self.args.dry_run:
-            logging.info(f"DRY RUN: Would have tried to delete VM data directory: {vm_dir}.")
+            logging.info("DRY RUN: Would have tried to delete VM data directory: %s.", vm_dir)
             return
 
         if not os.path.exists(vm_dir):
-            logging.info(f"VM data directory {vm_dir} not found. Nothing to delete.")
+            logging.info("VM data directory %s not found. Nothing to delete.", vm_dir)
             return
 
         if not self.args.deleteifexists:
             logging.fatal("VM directory found, but --deleteifexists flag not passed.")
 
-        logging.info(f"Attempting to delete VM directory: {vm_dir}.")
+        logging.info("Attempting to delete VM directory: %s.", vm_dir)
         shutil.rmtree(vm_dir)
 
     def normalizeVMState(self):
@@ -428,32 +543,42 @@ class VMBuilder(object):
         self.deleteVM()
         self.deleteVMImage()
 
+    def getBaseVirtInstallFlags(self):
+        """Return virt-install options and flags shared by every cluster member."""
+        if VMBuilder.base_virt_install_flags is None:
+            with VMBuilder.init_lock:
+                if VMBuilder.base_virt_install_flags is None:
+                    options = []
+                    if self.args.debug:
+                        options.append("--debug")
+
+                    if self.getClusterSize() > 1:
+                        logging.info("More than one instance was asked to be created, "
+                                     "not connecting to console by default.")
+                        options.append("--noautoconsole")
+
+                    flags = {
+                        "connect": f"qemu+ssh://{self.getVmHost()}/system",
+                        "os-type": "linux",
+                        "ram": self.getRam(),
+                        "vcpus": self.getCpus(),
+                    }
+                    if self.args.use_uefi:
+                        flags["boot"] = "uefi"
+                    VMBuilder.base_virt_install_flags = (tuple(options), flags)
+        return VMBuilder.base_virt_install_flags
+
     def executeVirtInstall(self):
         """Execute virt-install with vm-specific flags."""
 
-        command_line = ["/usr/bin/virt-install", "--autostart",
-                        "--nographics",
-                        '--console pty,target_type=serial']
-        if self.args.debug:
-            command_line.extend(["--debug"])
-
-        if self.getClusterSize() > 1:
-            logging.info("More than one instance was asked to be created, "
-                         "not connecting to console by default.")
-            command_line.extend(["--noautoconsole"])
-
-        flags = {
-            "connect": f"qemu+ssh://{self.getVmHost()}/system",
-            "disk": [f"vol={self.getVmStoragePoolName()}/{self.getVmDiskImageName},cache=none"],
-            "name": self.getVmName(),
-            "network": f"bridge={self.getNetworkBridgeInterface()},model=virtio,mac={self.getMacAddress()}",
-            "os-type": "linux",
-            "ram": self.getRam(),
-            "vcpus": self.getCpus(),
-        }
-
-        if self.args.use_uefi:
-            flags.update({"boot": "uefi"})
+        options, base_flags = self.getBaseVirtInstallFlags()
+        disk_vol = f"{self.getVmStoragePoolName()}/{self.getVmDiskImageName()}"
+        flags = dict(
+            base_flags,
+            disk=[f"vol={disk_vol},cache=none"],
+            name=self.getVmName(),
+            network=f"bridge={self.getNetworkBridgeInterface()},model=virtio,mac={self.getMacAddress()}",
+        )
 
         virt_install_custom_flags = self.getBuild().getVirtInstallCustomFlags()
         if virt_install_custom_flags:
@@ -464,31 +589,26 @@ class VMBuilder(object):
             logging.debug("Found extra-args for virt-install.")
             flags.update({'extra-args': extra_args})
 
-        # TODO: simplify this logic to see if we need to have multiples
-        # of one flag.
-        for flag, values in flags.items():
-            if isinstance(values, list):
-                if len(values) > 1:
-                    # multiple instances of an arg,
-                    # so we need to iterate over each arg
-                    for x in range(0,len(values)):
-                        command_line.extend(["--%s" % flag, str(values[x])])
-                else:
-                    command_line.extend(["--%s" % flag, str(values[0])])
-            else:
-                command_line.extend(["--%s" % flag, str(values)])
-
-            logging.debug(f"flag: {flag}, value: {values}")
-
-        str_command_line = " ".join(command_line)
+        # List values repeat their flag once per value.
+        command_line = list(itertools.chain(
+            VIRT_INSTALL_COMMAND,
+            options,
+            itertools.chain.from_iterable(
+                (f"--{flag}", str(value))
+                for flag, values in flags.items()
+                for value in (values if isinstance(values, list) else [values]))))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for flag, values in flags.items():
+                logging.debug("flag: %s, value: %s", flag, values)
 
         final_args = self.getBuild().getVirtInstallFinalArgs()
 
         if final_args:
-            logging.info(f"Adding final arguments to virt-install: {final_args}.")
-            str_command_line = str_command_line + " " + final_args
+            logging.info("Adding final arguments to virt-install: %s.", final_args)
+            command_line.extend(shlex.split(final_args))
 
-        logging.debug(f"virt-install command line: {str_command_line}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("virt-install command line: %s", shlex.join(command_line))
 
         self.getBuild().executePreVirtInstall()
 
@@ -496,36 +616,61 @@ class VMBuilder(object):
             logging.info("DRYRUN: VM not actually created. Skipping.")
             return
 
+        # Run virt-install directly rather than through /bin/sh. It needs
+        # none of our file descriptors, so skip closing them all. With
+        # close_fds=False and no stdio redirected onto fds 0-2,
+        # subprocess can start it with posix_spawn rather than fork+exec.
         returncode = subprocess.call(
-            str_command_line,
-            stderr=subprocess.STDOUT,
-            shell=True)
+            command_line,
+            close_fds=False)
 
-        logging.debug(f"virt-install returncode: {returncode}.")
+        logging.debug("virt-install returncode: %s.", returncode)
 
         if returncode != 0:
-            logging.exception("non-zero returncode from virt-install execution. exiting.")
-            raise
+            logging.error("non-zero returncode from virt-install execution. exiting.")
+            raise HandledException(f"virt-install exited with {returncode}.")
 
         self.getBuild().executePostVirtInstall()
 
+    def setVmState(self, cluster_index):
+        """Set per-VM state for the cluster member at cluster_index."""
+        self.setClusterIndex(cluster_index)
+        self.setVmHostName(self.getVmHostNameArg(), cluster_index,
+                           self.getClusterSize())
+
+    def buildVM(self, cluster_index):
+        """Build the cluster member at cluster_index, start to finish."""
+        self.setVmState(cluster_index)
+        logging.debug("Starting to build host %s.", self.getClusterIndex())
+        logging.info("Starting VM build for %s.", self.getVmName())
+        logging.info("Creating instance %s of cluster with %s instances.",
+                     self.getVmName(), self.args.cluster_size)
+
+        self.normalizeVMState()
+        self.createDiskImage()
+        self.executeVirtInstall()
+        logging.info("VM %s creation is complete.", self.getVmName())
+
     def createVM(self):
         """Main execution handler for the script."""
 
         self.setClusterVmSuffixes()
-        for cluster_index in range(0, self.getClusterSize()):
-            self.setClusterIndex(cluster_index)
-            logging.debug(f"Starting to build host {self.getClusterIndex()}.")
-            self.setVmHostName(self.getVmHostNameArg(), self.getClusterIndex(),
-                               self.getClusterSize())
-            logging.info(f"Starting VM build for {self.getVmName()}.")
-            logging.info(f"Creating instance {self.getVmName()} of cluster with {self.args.cluster_size} "
-                         f"instances.")
-
-            self.normalizeVMState()
-            self.createDiskImage()
-            self.executeVirtInstall()
-            logging.info(f"VM {self.getVmName()} creation is complete.")
+        workers = min(self.getClusterSize(), self.args.jobs)
+        if workers > 8:
+            logging.warning("Building %d VMs at once may exceed the SSH daemon's "
+                            "MaxStartups limit on %s.", workers, self.getVmHost())
+        # Cluster members are independent, so build up to --jobs of them
+        # concurrently over the shared libvirt connection, each in its own
+        # per-VM context. Shared images are prepared once under their own
+        # locks.
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run,
+                                self.buildVM, cluster_index)
+                for cluster_index in range(0, self.getClusterSize())]
+            for future in futures:
+                future.result()
 
     def verifyMinimumCreateVMArgs(self):
         """Verify that list of minimum args to create a VM were passed."""
@@ -623,30 +768,19 @@ class Debian(BaseVM):
         key=var,key=var,...
         as this is the expected format for virt-install.
         """
-        extra_args = {
-            "keyboard-configuration/xkb-keymap": "us",
-            "console-setup/ask_detect": "false",
-            "locale": "en_US",
+        extra_args = dict(PRESEED_EXTRA_ARGS)
+        extra_args.update({
             "netcfg/get_domain": self.args.domain_name,
             "netcfg/get_hostname": self.args.host_name,
             "preseed/url": self.getPreseedUrl(),
-        }
-
-        add_ons = ['serial', 'console=tty0', 'console=ttyS0,9600n8']
-        result = []
-
+        })
         extra_args.update(self.getNetworkExtraArgs())
         extra_args.update(self.getDistroSpecificExtraArgs())
-        for key, value in extra_args.iteritems():
-            result.append("%s=%s" % (key, value))
-        result = " ".join(result)
-
-        for current in add_ons:
-            result += " %s" % current
-
-        result = "\"%s\"" % result
 
-        return result
+        parts = [f"{key}={value}" for key, value in extra_args.items()]
+        parts.append(PRESEED_ADD_ONS)
+        # Passed as a single argv entry, so no shell quoting is needed.
+        return " ".join(parts)
 
 
 class Ubuntu(Debian):